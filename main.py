@@ -1,16 +1,30 @@
 import os
-from typing import List, Optional, Dict, Any
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Set, FrozenSet, Tuple, AsyncIterator
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from bson.objectid import ObjectId
+from datetime import datetime, timezone
+from pymongo import ReturnDocument, UpdateOne
+from urllib.parse import quote
 import re
-import requests
+import httpx
+from lxml import etree
+import numpy as np
+import orjson
+import xxhash
+from scipy.optimize import linear_sum_assignment
 
 from database import db, create_document, get_documents
 from schemas import Profile, Job, Application
 
-app = FastAPI(title="Job Auto Apply API")
+app = FastAPI(title="Job Auto Apply API", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,6 +34,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+logger = logging.getLogger(__name__)
+
+BULK_CHUNK = 1000  # ops per bulk_write call, keeps each command well under 16MB
+RANK_CACHE_SIZE = 128
+# keep-alive pool shared by the concurrent feed fetches of one ingest
+FETCH_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+# all feeds are started at once, so queued ones must wait for a free connection
+# rather than fail; connect/read still time out per request
+FETCH_TIMEOUT = httpx.Timeout(15, pool=None)
+
 
 # ---------- Utilities ----------
 
@@ -30,21 +54,166 @@ def to_object_id(id_str: str) -> ObjectId:
         raise HTTPException(status_code=400, detail="Invalid ID format")
 
 
+_TOKEN_RE = re.compile(r"[a-z0-9+#.]+", re.IGNORECASE | re.ASCII)
+
+
+def _raw_tokens(text: str) -> List[str]:
+    # lowercase the matches rather than copying the whole text first; a few
+    # non-ASCII letters lowercase to ASCII ones, so those texts take the slow path
+    if text.isascii():
+        return [t.lower() for t in _TOKEN_RE.findall(text)]
+    return _TOKEN_RE.findall(text.lower())
+
+
 def tokenize(text: str) -> List[str]:
     if not text:
         return []
-    return re.findall(r"[a-zA-Z0-9+#.]+", text.lower())
+    return _raw_tokens(text)
+
+
+def token_set(text: str) -> Set[str]:
+    if not text:
+        return set()
+    return set(_raw_tokens(text))
+
+
+def hash_tokens(tokens) -> np.ndarray:
+    """Sorted unique int64 xxh3 hashes of the given tokens"""
+    hashes = np.fromiter((xxhash.xxh3_64_intdigest(t) for t in tokens), dtype=np.uint64)
+    return np.unique(hashes.view(np.int64))
+
+
+def job_tokens(job: Dict[str, Any]) -> List[int]:
+    """Hashed distinct tokens of a job's title, company and description"""
+    return hash_tokens(token_set(" ".join([
+        job.get("title") or "",
+        job.get("company") or "",
+        job.get("description") or "",
+    ]))).tolist()
+
+
+async def bulk_write_chunked(collection: str, ops: list):
+    """Run unordered bulk writes in chunks; returns (upserted, modified) counts"""
+    upserted = modified = 0
+    for i in range(0, len(ops), BULK_CHUNK):
+        result = await db[collection].bulk_write(ops[i:i + BULK_CHUNK], ordered=False)
+        upserted += result.upserted_count
+        modified += result.modified_count
+    return upserted, modified
+
+
+async def stream_documents(cursor, field: str) -> AsyncIterator[bytes]:
+    """Encode {field: [...], "count": n} one cursor document at a time"""
+    yield b'{"' + field.encode() + b'":['
+    count = 0
+    async for doc in cursor:
+        if count:
+            yield b","
+        doc["_id"] = str(doc["_id"])
+        yield orjson.dumps(doc)
+        count += 1
+    yield b'],"count":' + str(count).encode() + b"}"
+
+
+# ---------- Startup ----------
+
+# (collection, keys, options) created at startup
+_INDEXES = [
+    # jobs are upserted by url, so it must be unique
+    ("job", "url", {"unique": True}),
+    # "none" keeps stemming and stop words out, so every profile token is searchable
+    ("job", [("title", "text"), ("company", "text"), ("description", "text")],
+     {"name": "job_text", "default_language": "none"}),
+    ("job", [("matched_score", -1)], {}),
+    ("profile", "email", {"unique": True}),
+    ("application", [("created_at", -1)], {}),
+]
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    if db is None:
+        return
+    # failures are logged, not raised: keep serving so /test can report what is wrong
+    try:
+        # open the pool before the first request instead of during it
+        await db.command("ping")
+    except Exception as e:
+        logger.error("Database ping failed: %s", e)
+        return
+    # one at a time, so e.g. duplicate emails blocking the unique index don't skip the rest
+    for collection, keys, options in _INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except Exception as e:
+            logger.error("Index setup failed on %s: %s", collection, e)
+
+
+async def backfill_job_tokens(query: dict):
+    """Store _tokens on the jobs matching query, in bulk batches"""
+    ops = []
+    async for job in db["job"].find(query, {"title": 1, "company": 1, "description": 1}):
+        ops.append(UpdateOne({"_id": job["_id"]}, {"$set": {"_tokens": job_tokens(job)}}))
+        if len(ops) >= BULK_CHUNK:
+            await bulk_write_chunked("job", ops)
+            ops = []
+    await bulk_write_chunked("job", ops)
+
+
+async def migrate_job_tokens():
+    await backfill_job_tokens({"_tokens": {"$exists": False}})
+    # jobs stored before ingest set a default score would stay hidden from /jobs
+    await db["job"].update_many({"matched_score": {"$exists": False}}, {"$set": {"matched_score": 0.0}})
+    # cached rankings were computed without these tokens
+    await bump_jobs_version()
+
+
+async def migrate_job_token_hashes():
+    # jobs still holding string tokens would never intersect the hashed profile terms
+    await backfill_job_tokens({"_tokens.0": {"$type": "string"}})
+    await bump_jobs_version()
+
+
+# one-shot data migrations, run in order; each is recorded in meta/migrations once done
+MIGRATIONS = [
+    ("job_tokens", migrate_job_tokens),
+    ("job_token_hashes", migrate_job_token_hashes),
+]
+
+
+async def run_migrations():
+    try:
+        done = await db["meta"].find_one({"_id": "migrations"}) or {}
+        for name, migrate in MIGRATIONS:
+            if done.get(name):
+                continue
+            await migrate()
+            await db["meta"].update_one({"_id": "migrations"}, {"$set": {name: True}}, upsert=True)
+    except Exception as e:
+        logger.error("Data migration failed: %s", e)
+
+
+_migrations_task: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def start_migrations():
+    global _migrations_task
+    if db is None:
+        return
+    # in the background, so a large backfill never holds up serving
+    _migrations_task = asyncio.create_task(run_migrations())
 
 
 # ---------- Health ----------
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Job Auto Apply Backend running"}
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -59,7 +228,7 @@ def test_database():
             response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
             response["database_name"] = db.name
             response["connection_status"] = "Connected"
-            collections = db.list_collection_names()
+            collections = await db.list_collection_names()
             response["collections"] = collections
         else:
             response["database"] = "⚠️ Available but not initialized"
@@ -71,7 +240,7 @@ def test_database():
 # ---------- Schemas endpoint (viewer support) ----------
 
 @app.get("/schema")
-def get_schema_definitions():
+async def get_schema_definitions():
     from schemas import Profile, Job, Application
     return {
         "profile": Profile.model_json_schema(),
@@ -97,28 +266,27 @@ class ProfileIn(BaseModel):
 
 
 @app.post("/profile")
-def upsert_profile(payload: ProfileIn):
+async def upsert_profile(payload: ProfileIn):
     if db is None:
         raise HTTPException(500, "Database not configured")
     data = payload.model_dump()
-    existing = db["profile"].find_one({"email": data["email"]})
-    if existing:
-        db["profile"].update_one({"_id": existing["_id"]}, {"$set": data})
-        _id = existing["_id"]
-    else:
-        inserted_id = create_document("profile", data)
-        _id = ObjectId(inserted_id)
-    doc = db["profile"].find_one({"_id": _id})
+    now = datetime.now(timezone.utc)
+    doc = await db["profile"].find_one_and_update(
+        {"email": data["email"]},
+        {"$set": {**data, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
     doc["_id"] = str(doc["_id"])
     return doc
 
 
 @app.get("/profile")
-def get_profile(email: Optional[str] = None):
+async def get_profile(email: Optional[str] = None):
     if db is None:
         raise HTTPException(500, "Database not configured")
     q = {"email": email} if email else {}
-    doc = db["profile"].find_one(q) if email else db["profile"].find_one()
+    doc = await db["profile"].find_one(q) if email else await db["profile"].find_one()
     if not doc:
         raise HTTPException(404, "Profile not found")
     doc["_id"] = str(doc["_id"])
@@ -129,80 +297,104 @@ def get_profile(email: Optional[str] = None):
 
 def build_indeed_rss_urls(profile: dict) -> List[str]:
     base = "https://ae.indeed.com/rss"
-    urls = []
     titles = profile.get("target_titles") or []
     locs = profile.get("locations") or ["United Arab Emirates"]
     if not titles:
         titles = ["Digital Health", "Healthcare AI", "Medical Director", "Clinical" ]
-    for t in titles:
-        q = requests.utils.quote(t)
-        for l in locs:
-            ll = requests.utils.quote(l)
-            urls.append(f"{base}?q={q}&l={ll}")
-    return list(dict.fromkeys(urls))
+    # quote each distinct term once, then take the cross product
+    qs = [quote(t) for t in dict.fromkeys(titles)]
+    ls = [quote(l) for l in dict.fromkeys(locs)]
+    return list(dict.fromkeys(f"{base}?q={q}&l={ll}" for q in qs for ll in ls))
+
+
+# descriptions carry escaped HTML markup, which lxml hands back as literal text
+_TAG_RE = re.compile(r"<.*?>")
+
+
+def _item_to_dict(item) -> Dict[str, Any]:
+    title = (item.findtext("title") or "").strip()
+    link = (item.findtext("link") or "").strip()
+    desc = _TAG_RE.sub("", item.findtext("description") or "").strip()
+    pub = (item.findtext("pubDate") or "").strip() or None
+    company = None
+    # Indeed "title" often like: Title - Company - Location
+    parts = [p.strip() for p in title.split(" - ")]
+    if len(parts) >= 2:
+        title_clean = parts[0]
+        company = parts[1]
+    else:
+        title_clean = title
+    return {
+        "source": "indeed",
+        "source_id": None,
+        "title": title_clean,
+        "company": company,
+        "location": None,
+        "url": link,
+        "description": desc,
+        "posted_at": pub,
+        "tags": [],
+    }
 
 
-def parse_indeed_rss(url: str) -> List[Dict[str, Any]]:
-    # RSS is XML; we avoid heavy deps: simple regex-based minimal parse for item blocks
+async def parse_indeed_rss(client: httpx.AsyncClient, url: str) -> AsyncIterator[Dict[str, Any]]:
+    # items are emitted as soon as their closing tag arrives, then cut from the tree,
+    # so memory tracks the largest item rather than the whole feed. Feeds are
+    # untrusted: never expand entities or fetch external DTDs
+    parser = etree.XMLPullParser(events=("end",), tag="item", resolve_entities=False, no_network=True)
     try:
-        resp = requests.get(url, timeout=15)
-        resp.raise_for_status()
-        text = resp.text
+        async with client.stream("GET", url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.aiter_bytes():
+                parser.feed(chunk)
+                for _, item in parser.read_events():
+                    yield _item_to_dict(item)
+                    item.clear()
+                    while item.getprevious() is not None:
+                        del item.getparent()[0]
     except Exception as e:
-        return []
-    items = []
-    for block in re.findall(r"<item>(.*?)</item>", text, flags=re.S | re.I):
-        def tag(name):
-            m = re.search(rf"<{name}>(.*?)</{name}>", block, flags=re.S | re.I)
-            return re.sub(r"<.*?>", "", m.group(1)).strip() if m else None
-        title = tag("title") or ""
-        link = tag("link") or ""
-        desc = tag("description") or ""
-        pub = tag("pubDate") or None
-        company = None
-        # Indeed "title" often like: Title - Company - Location
-        parts = [p.strip() for p in title.split(" - ")]
-        if len(parts) >= 2:
-            title_clean = parts[0]
-            company = parts[1]
-        else:
-            title_clean = title
-        items.append({
-            "source": "indeed",
-            "source_id": None,
-            "title": title_clean,
-            "company": company,
-            "location": None,
-            "url": link,
-            "description": desc,
-            "posted_at": pub,
-            "tags": [],
-        })
-    return items
+        return
 
 
 @app.post("/ingest/indeed")
-def ingest_indeed(email: Optional[str] = None):
+async def ingest_indeed(email: Optional[str] = None):
     if db is None:
         raise HTTPException(500, "Database not configured")
-    profile = db["profile"].find_one({"email": email}) if email else db["profile"].find_one()
+    profile = await db["profile"].find_one({"email": email}) if email else await db["profile"].find_one()
     if not profile:
         raise HTTPException(400, "Profile not found. Create it first.")
     urls = build_indeed_rss_urls(profile)
-    all_items: List[Dict[str, Any]] = []
-    for u in urls:
-        items = parse_indeed_rss(u)
-        all_items.extend(items)
+    found = 0
+    # the same posting often comes back for several title/location queries
+    jobs_by_url: Dict[str, Dict[str, Any]] = {}
+
+    async def collect(url: str):
+        nonlocal found
+        async for item in parse_indeed_rss(client, url):
+            found += 1
+            if item.get("url"):
+                jobs_by_url[item["url"]] = item
+
+    async with httpx.AsyncClient(timeout=FETCH_TIMEOUT, limits=FETCH_LIMITS) as client:
+        await asyncio.gather(*(collect(u) for u in urls))
     # upsert jobs by url
-    inserted = 0
-    for job in all_items:
-        existing = db["job"].find_one({"url": job["url"]})
-        if existing:
-            db["job"].update_one({"_id": existing["_id"]}, {"$set": job})
-        else:
-            create_document("job", job)
-            inserted += 1
-    return {"sources": urls, "found": len(all_items), "inserted": inserted}
+    now = datetime.now(timezone.utc)
+    ops = [
+        UpdateOne(
+            {"url": job["url"]},
+            {
+                "$set": {**job, "_tokens": job_tokens(job), "updated_at": now},
+                # unscored until the next /match, but still listed by /jobs?min_score=0
+                "$setOnInsert": {"created_at": now, "matched_score": 0.0},
+            },
+            upsert=True,
+        )
+        for job in jobs_by_url.values()
+    ]
+    inserted, _ = await bulk_write_chunked("job", ops)
+    if ops:
+        await bump_jobs_version()
+    return {"sources": urls, "found": found, "inserted": inserted}
 
 
 # ---------- Matching ----------
@@ -212,63 +404,223 @@ class MatchRequest(BaseModel):
     top_n: int = 50
 
 
+async def jobs_version() -> int:
+    meta = await db["meta"].find_one({"_id": "job"})
+    return meta["version"] if meta else 0
+
+
+async def bump_jobs_version():
+    await db["meta"].update_one({"_id": "job"}, {"$inc": {"version": 1}}, upsert=True)
+
+
+def _overlap_expr(tokens: FrozenSet[str], weight: float) -> dict:
+    return {"$multiply": [{"$size": {"$setIntersection": [{"$ifNull": ["$_tokens", []]}, hash_tokens(tokens).tolist()]}}, weight]}
+
+
+async def clear_scores():
+    await db["job"].update_many({"matched_score": {"$gt": 0}}, {"$set": {"matched_score": 0.0}})
+
+
+async def score_jobs(
+    titles: FrozenSet[str], skills: FrozenSet[str], cv_tokens: FrozenSet[str]
+) -> Tuple[Tuple[ObjectId, float], ...]:
+    """Score candidate jobs for a profile on the server; returns scored jobs, best first"""
+    # only jobs sharing at least one term with the profile can score above zero
+    terms = titles | skills | cv_tokens
+    if not terms:
+        return ()
+    pipeline = [
+        {"$match": {"$text": {"$search": " ".join(terms)}}},
+        {"$project": {"matched_score": {"$round": [{"$add": [
+            _overlap_expr(titles, 2.0),
+            _overlap_expr(skills, 1.5),
+            _overlap_expr(cv_tokens, 0.2),
+        ]}, 2]}}},
+        {"$match": {"matched_score": {"$gt": 0}}},
+        {"$sort": {"matched_score": -1}},
+    ]
+    # the ranking comes from this pipeline's output only, never from the shared
+    # matched_score field, which a concurrent /match may be rewriting
+    return tuple([(j["_id"], j["matched_score"]) async for j in db["job"].aggregate(pipeline)])
+
+
+# LRU of rankings keyed by (titles, skills, cv_tokens, jobs_version);
+# lru_cache can't memoize coroutines, so this is kept by hand
+_rank_cache: "OrderedDict[tuple, Tuple[Tuple[ObjectId, float], ...]]" = OrderedDict()
+
+
+async def rank_jobs(key: tuple) -> Tuple[Tuple[ObjectId, float], ...]:
+    ranked = _rank_cache.get(key)
+    if ranked is not None:
+        _rank_cache.move_to_end(key)
+        return ranked
+    ranked = await score_jobs(*key[:3])
+    _rank_cache[key] = ranked
+    if len(_rank_cache) > RANK_CACHE_SIZE:
+        _rank_cache.popitem(last=False)
+    return ranked
+
+
+def scores_digest(key: tuple) -> str:
+    """Stable id of a rank_jobs key, comparable across worker processes"""
+    h = hashlib.sha1()
+    for tokens in key[:3]:
+        h.update("\x1f".join(sorted(tokens)).encode())
+        h.update(b"\x1e")
+    h.update(str(key[3]).encode())
+    return h.hexdigest()
+
+
+# check + clear + write must not interleave with another profile's, or the stored scores mix
+_store_lock = asyncio.Lock()
+
+
+async def store_scores(ranked: Tuple[Tuple[ObjectId, float], ...], digest: str):
+    """Write a ranking's scores unless meta says they are already the stored ones"""
+    async with _store_lock:
+        meta = await db["meta"].find_one({"_id": "job"}, {"scored_for": 1})
+        if meta and meta.get("scored_for") == digest:
+            return
+        # unmark first so a half-finished rewrite is never taken as current
+        await db["meta"].update_one({"_id": "job"}, {"$set": {"scored_for": None}}, upsert=True)
+        await clear_scores()
+        await bulk_write_chunked("job", [
+            UpdateOne({"_id": _id}, {"$set": {"matched_score": score}}) for _id, score in ranked
+        ])
+        await db["meta"].update_one({"_id": "job"}, {"$set": {"scored_for": digest}})
+
+
+def profile_tokens(profile: dict) -> Tuple[FrozenSet[str], FrozenSet[str], FrozenSet[str]]:
+    """Title, skill and CV token sets of a profile"""
+    return (
+        frozenset(token_set(" ".join(profile.get("target_titles") or []))),
+        frozenset(token_set(" ".join(profile.get("skills") or []))),
+        frozenset(token_set(profile.get("cv_text", ""))),
+    )
+
+
+async def profile_ranking(profile: dict) -> Tuple[tuple, Tuple[Tuple[ObjectId, float], ...]]:
+    """Cache key and scored jobs for a profile, best first; nothing is written"""
+    key = (*profile_tokens(profile), await jobs_version())
+    return key, await rank_jobs(key)
+
+
 @app.post("/match")
-def match_jobs(payload: MatchRequest):
+async def match_jobs(payload: MatchRequest):
     if db is None:
         raise HTTPException(500, "Database not configured")
-    profile = db["profile"].find_one({"email": payload.email}) if payload.email else db["profile"].find_one()
+    profile = await db["profile"].find_one({"email": payload.email}) if payload.email else await db["profile"].find_one()
     if not profile:
         raise HTTPException(400, "Profile not found")
-    skills = set(tokenize(" ".join(profile.get("skills") or [])))
-    titles = set(tokenize(" ".join(profile.get("target_titles") or [])))
-    cv_tokens = set(tokenize(profile.get("cv_text", "")))
-
-    jobs = list(db["job"].find())
-    for j in jobs:
-        text = " ".join([
-            j.get("title") or "",
-            j.get("company") or "",
-            j.get("description") or "",
-        ])
-        jt = set(tokenize(text))
-        score = 0.0
-        if titles:
-            score += len(jt & titles) * 2.0
-        if skills:
-            score += len(jt & skills) * 1.5
-        score += len(jt & cv_tokens) * 0.2
-        j["matched_score"] = round(score, 2)
-        db["job"].update_one({"_id": j["_id"]}, {"$set": {"matched_score": j["matched_score"]}})
-    jobs_sorted = sorted(jobs, key=lambda x: x.get("matched_score", 0), reverse=True)[: payload.top_n]
+    key, ranked = await profile_ranking(profile)
+    await store_scores(ranked, scores_digest(key))
+    top = ranked[: payload.top_n]
+    # the pipeline only carried scores; load full documents for the winners
+    by_id = {j["_id"]: j async for j in db["job"].find({"_id": {"$in": [_id for _id, _ in top]}}, {"_tokens": 0})}
+    # scores come from the ranking, not the stored field a concurrent /match may rewrite
+    jobs_sorted = [{**by_id[_id], "matched_score": score} for _id, score in top if _id in by_id]
     # serialize ids
     for j in jobs_sorted:
         j["_id"] = str(j["_id"])
     return {"count": len(jobs_sorted), "jobs": jobs_sorted}
 
 
+class AssignRequest(BaseModel):
+    # the solve grows with profiles x per_profile rows, so keep it bounded
+    per_profile: int = Field(5, ge=1, le=50)
+
+
+def score_matrix(profiles: List[dict], job_tokens_list: List[List[int]]) -> np.ndarray:
+    """profiles x jobs matrix of the /match score"""
+    sizes = [len(t) for t in job_tokens_list]
+    tokens = np.fromiter((h for t in job_tokens_list for h in t), dtype=np.int64, count=sum(sizes))
+    owner = np.repeat(np.arange(len(job_tokens_list)), sizes)
+    S = np.zeros((len(profiles), len(job_tokens_list)), dtype=np.float32)
+    for i, profile in enumerate(profiles):
+        for toks, weight in zip(profile_tokens(profile), (2.0, 1.5, 0.2)):
+            hits = owner[np.isin(tokens, hash_tokens(toks))]
+            S[i] += weight * np.bincount(hits, minlength=len(job_tokens_list))
+    return S
+
+
+def solve_assignment(profiles: List[dict], jobs: List[dict], per_profile: int) -> List[Tuple[str, ObjectId, float]]:
+    """(email, job _id, score) pairs maximising the total score, one job per profile slot"""
+    if not jobs:
+        return []
+    S = score_matrix(profiles, [j["_tokens"] for j in jobs])
+    # only jobs some profile scores above zero can be worth assigning
+    cols = np.flatnonzero(S.max(axis=0) > 0)
+    if not cols.size:
+        return []
+    # no profile can take more slots than there are jobs to fill them
+    per_profile = min(per_profile, cols.size)
+    # one row per profile slot; Hungarian maximises the summed score over all slots
+    slots = np.repeat(S[:, cols], per_profile, axis=0)
+    rows, picks = linear_sum_assignment(slots, maximize=True)
+    return [
+        (profiles[r // per_profile]["email"], jobs[cols[c]]["_id"], round(float(slots[r, c]), 2))
+        for r, c in zip(rows, picks)
+        if slots[r, c] > 0
+    ]
+
+
+# reset + write must not interleave with another /match/assign, or assignments mix
+_assign_lock = asyncio.Lock()
+
+
+@app.post("/match/assign")
+async def assign_jobs(payload: AssignRequest):
+    """Give each profile up to per_profile jobs without handing one job to two profiles"""
+    if db is None:
+        raise HTTPException(500, "Database not configured")
+    profiles = await db["profile"].find({}, {"email": 1, "target_titles": 1, "skills": 1, "cv_text": 1}).to_list(length=None)
+    if not profiles:
+        raise HTTPException(400, "Profile not found")
+    # neither path touches matched_score; only assigned_to is written
+    if len(profiles) == 1:
+        _, ranked = await profile_ranking(profiles[0])
+        pairs = [(profiles[0]["email"], _id, score) for _id, score in ranked[: payload.per_profile]]
+    else:
+        jobs = await db["job"].find({"_tokens.0": {"$type": "number"}}, {"_tokens": 1}).to_list(length=None)
+        # the matrix build and the O(n^3) solve would otherwise stall the event loop
+        pairs = await run_in_threadpool(solve_assignment, profiles, jobs, payload.per_profile)
+    async with _assign_lock:
+        await db["job"].update_many({"assigned_to": {"$ne": None}}, {"$set": {"assigned_to": None}})
+        await bulk_write_chunked("job", [
+            UpdateOne({"_id": _id}, {"$set": {"assigned_to": email}}) for email, _id, _ in pairs
+        ])
+    assignments = [{"email": email, "job_id": str(_id), "score": score} for email, _id, score in pairs]
+    return {"count": len(assignments), "assignments": assignments}
+
+
 # ---------- Applications ----------
 
 class ApplyRequest(BaseModel):
     job_id: str
 
 
+# checked in priority order: an indeed redirect to a greenhouse board is greenhouse
+_CHANNEL_MAP = {
+    "greenhouse.io": "greenhouse",
+    "jobs.lever.co": "lever",
+    "workable.com": "workable",
+    "indeed": "indeed",
+}
+_CHANNEL_RE = re.compile("|".join(re.escape(k) for k in _CHANNEL_MAP))
+
+
 def detect_channel(url: str) -> str:
-    if "greenhouse.io" in url:
-        return "greenhouse"
-    if "jobs.lever.co" in url:
-        return "lever"
-    if "workable.com" in url:
-        return "workable"
-    if "indeed" in url:
-        return "indeed"
-    return "other"
+    found = set(_CHANNEL_RE.findall(url))
+    if not found:
+        return "other"
+    return next(_CHANNEL_MAP[k] for k in _CHANNEL_MAP if k in found)
 
 
 @app.post("/apply")
-def queue_application(payload: ApplyRequest):
+async def queue_application(payload: ApplyRequest):
     if db is None:
         raise HTTPException(500, "Database not configured")
-    job = db["job"].find_one({"_id": to_object_id(payload.job_id)})
+    job = await db["job"].find_one({"_id": to_object_id(payload.job_id)})
     if not job:
         raise HTTPException(404, "Job not found")
     channel = detect_channel(job.get("url", ""))
@@ -282,29 +634,25 @@ def queue_application(payload: ApplyRequest):
         "status": status,
         "notes": None,
     }
-    create_document("application", app_doc)
+    await create_document("application", app_doc)
     return {"message": "Application queued", "channel": channel, "status": status}
 
 
 @app.get("/jobs")
-def list_jobs(min_score: Optional[float] = 0.0, limit: int = 50):
+async def list_jobs(min_score: Optional[float] = 0.0, limit: int = 50):
     if db is None:
         raise HTTPException(500, "Database not configured")
-    cur = db["job"].find({"matched_score": {"$gte": float(min_score)}}).sort("matched_score", -1).limit(limit)
-    jobs = list(cur)
-    for j in jobs:
-        j["_id"] = str(j["_id"])
-    return {"count": len(jobs), "jobs": jobs}
+    query = {"matched_score": {"$gte": float(min_score)}}
+    cur = db["job"].find(query, {"description": 0, "_tokens": 0}).sort("matched_score", -1).limit(limit)
+    return StreamingResponse(stream_documents(cur, "jobs"), media_type="application/json")
 
 
 @app.get("/applications")
-def list_applications():
+async def list_applications():
     if db is None:
         raise HTTPException(500, "Database not configured")
-    apps = list(db["application"].find().sort("created_at", -1))
-    for a in apps:
-        a["_id"] = str(a["_id"])
-    return {"count": len(apps), "applications": apps}
+    cur = db["application"].find().sort("created_at", -1)
+    return StreamingResponse(stream_documents(cur, "applications"), media_type="application/json")
 
 
 if __name__ == "__main__":
@@ -37,6 +37,7 @@ class Job(BaseModel):
     posted_at: Optional[str] = None
     tags: List[str] = Field(default_factory=list)
     matched_score: Optional[float] = None
+    assigned_to: Optional[str] = None  # profile email chosen by /match/assign
 
 
 class Application(BaseModel):